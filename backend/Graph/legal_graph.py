@@ -1,34 +1,47 @@
 from typing import Dict, List, Any, Optional, AsyncGenerator
+import asyncio
+import os
 from loguru import logger
-from langchain_openai import ChatOpenAI
 from models.models import GraphState
 
 try:
     from langgraph.graph import StateGraph, END
+    from langgraph.types import Command
     LANGGRAPH_IMPORTS_OK = True
 except ImportError as e:
     logger.error(f"Failed to import langgraph: {e}")
     LANGGRAPH_IMPORTS_OK = False
 
-from config.config import OPENAI_API_KEY
-from nodes.handle_document import handle_document_query
+from config.config import SEMANTIC_CACHE_ENABLED
 from nodes.handle_general import handle_general_query
-from nodes.handle_hybrid import handle_hybrid_query
+from nodes.handle_hybrid import (
+    generate_with_context,
+    prefetch_general_context,
+    retrieve_doc_context,
+)
 from nodes.routing import route_query
+from services.conversation import chat_llm
+from utils.dataBase_integration import get_session_file_refs
+from utils.faiss_integration import embed_query_vector
+from utils.semantic_cache import semantic_cache
 
 
-# Initialize models
-llm = ChatOpenAI(
-    api_key=OPENAI_API_KEY,
-    model="gpt-4o-mini",
-    temperature=0.1,
-    streaming=True,
-)
+# Nodes each route decision fans out to; hybrid retrieval and context
+# preparation run concurrently and are joined by the combiner
+ROUTE_TARGETS = {
+    "general": "general_query",
+    "hybrid": ["retrieve_doc_context", "prefetch_general_context"],
+}
+
+# Nodes whose LLM tokens make up the answer streamed back to the user
+RESPONSE_NODES = {"general_query", "combiner"}
 
 
 class LegalChatGraph:
     def __init__(self):
         self.graph = self._create_graph()
+        # Caps concurrent graph runs so bursts of sockets don't trigger API 429s
+        self._sem = asyncio.Semaphore((os.cpu_count() or 1) * 8)
 
     def _create_graph(self) -> StateGraph:
         """Create the LangGraph workflow"""
@@ -36,73 +49,103 @@ class LegalChatGraph:
 
         # Adding nodes
         workflow.add_node("router", self._route_query)
-        workflow.add_node("document_query", self._handle_document_query)
         workflow.add_node("general_query", self._handle_general_query)
-        workflow.add_node("hybrid_query", self._handle_hybrid_query)
+        workflow.add_node("retrieve_doc_context", self._retrieve_doc_context)
+        workflow.add_node("prefetch_general_context", self._prefetch_general_context)
+        workflow.add_node("combiner", self._generate_with_context)
 
-        # Adding edges
+        # Adding edges; the router picks its targets via Command(goto=...)
         workflow.set_entry_point("router")
-        workflow.add_conditional_edges(
-            "router",
-            self._routing_decision,
-            {
-                "document": "document_query",
-                "general": "general_query",
-                "hybrid": "hybrid_query",
-            },
+        workflow.add_edge(
+            ["retrieve_doc_context", "prefetch_general_context"], "combiner"
         )
 
         # All paths lead to END
-        workflow.add_edge("document_query", END)
         workflow.add_edge("general_query", END)
-        workflow.add_edge("hybrid_query", END)
+        workflow.add_edge("combiner", END)
 
         return workflow.compile()
 
-    async def _route_query(self, state: GraphState) -> GraphState:
-        return await route_query(state, llm)
-
-    def _routing_decision(self, state: GraphState) -> str:
-        return state.route_decision or "general"
+    async def _route_query(self, state: GraphState) -> Command:
+        update = await route_query(state)
+        return Command(update=update, goto=self._routing_decision(update))
 
-    async def _handle_document_query(self, state: GraphState) -> GraphState:
-        return await handle_document_query(state, llm)
+    def _routing_decision(self, state: GraphState):
+        return ROUTE_TARGETS.get(state.get("route_decision"), ROUTE_TARGETS["general"])
 
     async def _handle_general_query(self, state: GraphState) -> GraphState:
-        return await handle_general_query(state, llm)
+        return await handle_general_query(state)
 
-    async def _handle_hybrid_query(self, state: GraphState) -> GraphState:
-        return await handle_hybrid_query(state, llm)
+    async def _retrieve_doc_context(self, state: GraphState) -> GraphState:
+        return await retrieve_doc_context(state)
+
+    async def _prefetch_general_context(self, state: GraphState) -> GraphState:
+        return await prefetch_general_context(state)
+
+    async def _generate_with_context(self, state: GraphState) -> GraphState:
+        return await generate_with_context(state)
 
     async def process_query(
         self, query: str, session_id: str, conversation_history: List[Dict] = None
     ) -> AsyncGenerator[str, None]:
         """Process a query through the graph and stream the response"""
-        initial_state = GraphState(
-            query=query,
-            session_id=session_id,
-            conversation_history=conversation_history or [],
-        )
+        initial_state: GraphState = {
+            "query": query,
+            "session_id": session_id,
+            "conversation_history": conversation_history or [],
+        }
 
         try:
-            final_state = await self.graph.ainvoke(initial_state)
-
-            # LangGraph returns state as dict, not object
-            if isinstance(final_state, dict):
-                response_stream = final_state.get("response_stream")
-                response = final_state.get("response")
-            else:
-                response_stream = getattr(final_state, 'response_stream', None)
-                response = getattr(final_state, 'response', None)
-
-            # Stream from the response_stream if available
-            if response_stream:
-                async for chunk in response_stream:
-                    yield chunk
-            elif response:
-                yield response
-            else:
-                yield "I'm sorry, I couldn't generate a response. Please try again."
+            # Only document sessions use the cache: their retrieval needs the
+            # query embedding anyway, so the lookup adds no extra round trip
+            query_vector = None
+            if (
+                SEMANTIC_CACHE_ENABLED
+                and semantic_cache.is_cacheable(query)
+                and await get_session_file_refs(session_id)
+            ):
+                try:
+                    query_vector = await embed_query_vector(query)
+                    initial_state["query_vector"] = query_vector
+                except Exception as e:
+                    logger.error(f"Failed to embed query for semantic cache: {e}")
+
+            if query_vector is not None:
+                cached = semantic_cache.lookup(session_id, query_vector)
+                if cached:
+                    logger.info(f"Semantic cache hit for session {session_id}")
+                    for chunk in cached:
+                        yield chunk
+                    return
+
+            async with self._sem:
+                streamed = False
+                chunks = []
+                final_state: GraphState = {}
+
+                # Tokens are forwarded as the answering node produces them;
+                # the final values are kept for responses without an LLM call
+                async for mode, payload in self.graph.astream(
+                    initial_state, stream_mode=["messages", "values"]
+                ):
+                    if mode == "values":
+                        final_state = payload
+                        continue
+
+                    message, metadata = payload
+                    if metadata.get("langgraph_node") in RESPONSE_NODES and message.content:
+                        streamed = True
+                        chunks.append(message.content)
+                        yield message.content
+
+                if not streamed:
+                    response = final_state.get("response")
+                    if response:
+                        yield response
+                    else:
+                        yield "I'm sorry, I couldn't generate a response. Please try again."
+                elif query_vector is not None and not final_state.get("error"):
+                    semantic_cache.store(session_id, query_vector, chunks)
 
         except Exception as e:
             logger.error(f"Error processing query through graph: {e}")
@@ -121,7 +164,6 @@ async def chat_llm_with_graph(
 ):
     """Enhanced chat function using LangGraph"""
     if not session_id or not LANGGRAPH_IMPORTS_OK:
-        from services.conversation import chat_llm
         async for chunk in chat_llm(query, conversation_history):
             yield chunk
         return
@@ -3,10 +3,6 @@ from dotenv import load_dotenv
 from loguru import logger
 
 dotenv_path = os.path.join(os.path.dirname(__file__), '..', '.env')
-load_dotenv(dotenv_path, override=True)
-
-logger.info("Attempting to load environment variables from .env file...")
-
 if os.path.exists(dotenv_path):
     load_dotenv(dotenv_path, override=True)
     logger.info(f"Environment variables loaded from {dotenv_path}")
@@ -26,3 +22,38 @@ if missing_vars:
     raise EnvironmentError(f"Missing environment variables: {', '.join(missing_vars)}")
 else:
     logger.info("All required environment variables are set.")
+
+# Max frames buffered per websocket before queued chunks are merged
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "32"))
+
+# Comma-separated list of origins allowed to call the API
+CORS_ORIGINS = [
+    origin.strip()
+    for origin in os.getenv(
+        "CORS_ORIGINS", "http://localhost:3000,http://127.0.0.1:3000"
+    ).split(",")
+    if origin.strip()
+]
+
+# Generate 32-char hex ids instead of hyphenated UUID4 strings
+COMPACT_IDS = os.getenv("COMPACT_IDS", "true").lower() in ("1", "true", "yes")
+
+# Replay a cached answer when a self-contained document question is near-identical
+# to an earlier one in the session; off by default since the match ignores history
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+
+# Directory holding a cross-encoder exported to ONNX (model.onnx + tokenizer.json);
+# reranking is skipped when unset
+RERANKER_MODEL_DIR = os.getenv("RERANKER_MODEL_DIR")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "50"))
+
+# text-embedding-3 models can return shortened vectors (e.g. 512 dims cuts index
+# size and search bandwidth 3x with little recall loss). 0 keeps the native 1536.
+# Documents embedded at another size are not searchable until re-uploaded.
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "0"))
+
+# SQLite file caching LLM responses to identical prompts (document summaries);
+# set to an empty string to disable
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3")
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
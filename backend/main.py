@@ -8,50 +8,258 @@ from fastapi import (
     WebSocketDisconnect,
 )
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-import json
-import uuid
+from fastapi.responses import ORJSONResponse, StreamingResponse
+import asyncio
+import orjson
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, AsyncIterator, Dict, List, Set, Tuple
+from bson import ObjectId
 from loguru import logger
 
 from uvicorn.protocols.utils import ClientDisconnected
 
 from utils.dataBase_integration import (
     add_message,
+    create_indexes,
     fetch_all_conversations,
     get_all_sessions_sorted,
     add_session,
+    conversations_collection,
+    ensure_session,
     files_collection,
-    sessions_collection,
+    invalidate_session_files,
+    update_session_title,
 )
 from utils.faiss_integration import (
     create_faiss_embeddings,
     get_document_info,
+    load_global_index,
     process_query_search,
+    shutdown_pdf_pool,
+    start_pdf_pool,
 )
 from Graph.legal_graph import chat_llm_with_graph
+from services.llm import http_client
+from config.config import CORS_ORIGINS, WS_SEND_QUEUE_SIZE
+from utils.ids import new_id
+from utils.semantic_cache import semantic_cache
 from services.conversation import generate_session_title  # Keep only this
-import os
-import aiofiles
+import io
 from pathlib import Path
-import tempfile
 from datetime import datetime
 
 from utils.faiss_integration import extract_pdf_sections
 from services.doc_chat import generate_document_summary
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await create_indexes()
+    await load_global_index()
+    start_pdf_pool()
+    yield
+    shutdown_pdf_pool()
+    await http_client.aclose()
+
+
+# orjson is already a dependency; it serializes the history, session and search
+# payloads several times faster than the stdlib encoder
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=CORS_ORIGINS,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["content-type", "authorization"],
+    max_age=86400,
 )
 
 FAISS_INDEX_DIR = Path("Faiss_index")
 FAISS_INDEX_DIR.mkdir(exist_ok=True)
 
+HISTORY_CACHE_SIZE = 1024
+
+# Placeholder shown until the generated title is ready; the UI replaces it
+NEW_SESSION_TITLE = "New Chat"
+
+# session_id -> (_id of the newest stored message, conversation history)
+_history_cache: "OrderedDict[str, Tuple[ObjectId, List[Dict]]]" = OrderedDict()
+
+
+def _remember_history(session_id: str, tip_id: ObjectId, history: List[Dict]):
+    _history_cache[session_id] = (tip_id, history)
+    _history_cache.move_to_end(session_id)
+    while len(_history_cache) > HISTORY_CACHE_SIZE:
+        _history_cache.popitem(last=False)
+
+
+async def get_cached_history(session_id: str) -> List[Dict]:
+    """Fetch the session history, reloading it only when newer messages exist."""
+    tip = await conversations_collection.find_one(
+        {"session_id": session_id}, sort=[("_id", -1)], projection={"_id": 1}
+    )
+    if not tip:
+        return []
+
+    cached = _history_cache.get(session_id)
+    if cached and cached[0] == tip["_id"]:
+        _history_cache.move_to_end(session_id)
+        return cached[1]
+
+    history = await fetch_all_conversations(session_id) or []
+    _remember_history(session_id, tip["_id"], history)
+    return history
+
+
+def invalidate_history(session_id: str):
+    _history_cache.pop(session_id, None)
+
+
+async def record_turn(session_id: str, query: str, response_text: str):
+    """Store a chat turn and append it to the cached history."""
+    cached = _history_cache.get(session_id)
+    result = await add_message(session_id, query, response_text)
+
+    # Appending is only safe if the cached tip directly precedes this turn; any
+    # change to the entry during the insert means another write came first
+    if _history_cache.get(session_id) is not cached:
+        invalidate_history(session_id)
+        return
+    if not cached or not result.get("last_id"):
+        return
+
+    history = cached[1]
+    if query:
+        history.append(
+            {"role": "user", "message": query, "created_at": result["created_at"]}
+        )
+    if response_text:
+        history.append(
+            {"role": "ai", "message": response_text, "created_at": result["created_at"]}
+        )
+    _remember_history(session_id, result["last_id"], history)
+
+
+# Pre-encoded SSE framing for streamed summary chunks
+SSE_CHUNK_PREFIX = b'data: {"status": "summary_chunk", "content": '
+SSE_CHUNK_SUFFIX = b"}\n\n"
+
+# Token chunks are coalesced before being written to the websocket
+STREAM_BATCH_SIZE = 8
+STREAM_BATCH_INTERVAL = 0.05
+
+
+async def coalesce_stream(
+    stream: AsyncIterator[str],
+    max_chunks: int = STREAM_BATCH_SIZE,
+    max_delay: float = STREAM_BATCH_INTERVAL,
+) -> AsyncGenerator[str, None]:
+    """Group consecutive stream chunks so they can be sent as a single frame.
+
+    A batch is flushed once it holds ``max_chunks`` chunks or ``max_delay``
+    seconds after its first chunk arrived, whichever comes first.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    done = object()
+
+    async def pump():
+        try:
+            async for chunk in stream:
+                await queue.put(chunk)
+        finally:
+            await queue.put(done)
+
+    producer = asyncio.create_task(pump())
+    loop = asyncio.get_running_loop()
+    buf = []
+    deadline = None
+
+    try:
+        while True:
+            timeout = None if deadline is None else max(0, deadline - loop.time())
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                yield "".join(buf)
+                buf = []
+                deadline = None
+                continue
+
+            if item is done:
+                break
+
+            buf.append(item)
+            if deadline is None:
+                deadline = loop.time() + max_delay
+            if len(buf) >= max_chunks:
+                yield "".join(buf)
+                buf = []
+                deadline = None
+
+        if buf:
+            yield "".join(buf)
+
+        # Surface errors raised by the underlying stream
+        await producer
+    finally:
+        producer.cancel()
+
+
+async def _ws_sender(websocket: WebSocket, queue: asyncio.Queue):
+    """Write queued frames to the websocket until a None sentinel arrives."""
+    while True:
+        chunk = await queue.get()
+        if chunk is None:
+            return
+        await websocket.send_text(chunk)
+
+
+async def send_json_fast(websocket: WebSocket, payload: Dict):
+    """Send a JSON text frame encoded with orjson."""
+    await websocket.send_text(orjson.dumps(payload).decode())
+
+
+# Strong references to fire-and-forget tasks so they aren't garbage collected
+_background_tasks: Set[asyncio.Task] = set()
+
+
+def _spawn(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+async def _finalize_title(session_id: str, query: str, websocket: WebSocket):
+    """Generate the session title off the request path and push it to the client."""
+    try:
+        title = await generate_session_title(query)
+        await update_session_title(session_id, title)
+        await send_json_fast(
+            websocket,
+            {
+                "type": "title_update",
+                "session_id": session_id,
+                "title": title.strip("\"'"),
+            },
+        )
+    except (WebSocketDisconnect, ClientDisconnected):
+        logger.info(f"Client left before title for session {session_id} was sent")
+    except Exception as e:
+        logger.error(f"Error finalizing title for session {session_id}: {e}")
+
+
+def _enqueue_coalescing(queue: asyncio.Queue, chunk: str):
+    """Queue a frame; when the queue is full, merge everything queued into it."""
+    if queue.full():
+        pending = []
+        while not queue.empty():
+            pending.append(queue.get_nowait())
+        chunk = "".join(pending) + chunk
+    queue.put_nowait(chunk)
+
 
 @app.websocket("/ws/chat")
 async def websocket_endpoint(websocket: WebSocket):
@@ -59,55 +267,67 @@ async def websocket_endpoint(websocket: WebSocket):
     session_id = None
     try:
         while True:
-            data = await websocket.receive_json()
+            data = orjson.loads(await websocket.receive_text())
             query = data.get("query", "").strip()
             session_id = data.get("session_id")
 
-            title = None
-
             if not session_id:
-                session_id = str(uuid.uuid4())
-                title = await generate_session_title(query)
-                add_session(session_id, title)
+                session_id = new_id()
+                # The real title is generated in the background so the first
+                # answer token isn't held up by an extra LLM round-trip
+                await add_session(session_id, NEW_SESSION_TITLE)
+                _spawn(_finalize_title(session_id, query, websocket))
                 logger.info(
                     f"Created new session {session_id} for chat (no session_id provided)"
                 )
 
-                await websocket.send_json(
+                await send_json_fast(
+                    websocket,
                     {
                         "session_id": session_id,
-                        "title": title.strip("\"'"),
+                        "title": NEW_SESSION_TITLE,
                         "info": "New session created",
-                    }
+                    },
                 )
             else:
                 logger.info(f"Received session_id for chat: {session_id}")
 
-                existing_session = sessions_collection.find_one(
-                    {"session_id": session_id}
-                )
-                if not existing_session:
-                    title = await generate_session_title(query)
-                    add_session(session_id, title)
+                # Only pay for a title when the upsert actually created the session
+                if await ensure_session(session_id, NEW_SESSION_TITLE):
+                    _spawn(_finalize_title(session_id, query, websocket))
                     logger.info(
                         f"Created new session {session_id} for chat (session_id provided but didn't exist)"
                     )
                 else:
                     logger.info(f"Using existing session {session_id} for chat")
 
-            conversation_history = fetch_all_conversations(session_id) or []
+            conversation_history = await get_cached_history(session_id)
+
+            response_parts: List[str] = []
+
+            # Sending runs in its own task so a slow client never stalls the LLM
+            send_queue: asyncio.Queue = asyncio.Queue(maxsize=WS_SEND_QUEUE_SIZE)
+            sender_task = asyncio.create_task(_ws_sender(websocket, send_queue))
 
-            response_text = ""
+            try:
+                async for response in coalesce_stream(
+                    chat_llm_with_graph(query, conversation_history, session_id)
+                ):
+                    response_parts.append(response)
+                    if sender_task.done():
+                        break
+                    _enqueue_coalescing(send_queue, response)
 
-            async for response in chat_llm_with_graph(query, conversation_history, session_id):
-                response_text += response
-                try:
-                    await websocket.send_text(response)
-                except (WebSocketDisconnect, ClientDisconnected):
-                    logger.error("Client disconnected during streaming.")
-                    return
+                if not sender_task.done():
+                    await send_queue.put(None)
+                await sender_task
+            except (WebSocketDisconnect, ClientDisconnected):
+                logger.error("Client disconnected during streaming.")
+                return
+            finally:
+                sender_task.cancel()
 
-            add_message(session_id, query, response_text)
+            await record_turn(session_id, query, "".join(response_parts))
 
     except (WebSocketDisconnect, ClientDisconnected):
         logger.error("WebSocket disconnected.")
@@ -118,7 +338,7 @@ async def websocket_endpoint(websocket: WebSocket):
 @app.get("/chat/{session_id}")
 async def get_chat_history(session_id: str):
     """Fetch the chat history for a given session ID."""
-    history = fetch_all_conversations(session_id)
+    history = await fetch_all_conversations(session_id)
     if not history:
         return {"status": "error", "message": "No chat history found for this session."}
     return history
@@ -127,7 +347,7 @@ async def get_chat_history(session_id: str):
 @app.get("/sessions")
 async def get_sessions():
     """Fetch all unique chat sessions, sorted by creation time (earliest first)."""
-    sessions = get_all_sessions_sorted()
+    sessions = await get_all_sessions_sorted()
     return {"status": "success", "sessions": sessions}
 
 
@@ -136,6 +356,29 @@ async def health():
     return {"status": "ok"}
 
 
+async def _index_upload(
+    sections: List[Dict], file_id: str, session_id: str, filename: str, file_size: int
+):
+    """Embed an uploaded PDF and record it against its session."""
+    total_tokens = await create_faiss_embeddings(sections, file_id, filename)
+    await files_collection.insert_one(
+        {
+            "file_id": file_id,
+            "session_id": session_id,
+            "filename": filename,
+            "file_size": file_size,
+            "total_sections": len(sections),
+            "total_tokens": total_tokens,
+            "upload_date": datetime.utcnow(),
+            "status": "processed",
+        }
+    )
+
+    # Routing and cached answers must see the new document from the next turn
+    invalidate_session_files(session_id)
+    semantic_cache.invalidate(session_id)
+
+
 @app.post("/upload/summary")
 async def upload_and_stream_summary(
     file: UploadFile = File(...), session_id: str = Form(None)
@@ -145,67 +388,71 @@ async def upload_and_stream_summary(
     if not file.content_type.startswith("application/pdf"):
         raise HTTPException(400, "Invalid file type. PDF files only.")
 
-    file_id = str(uuid.uuid4())
+    file_id = new_id()
     if not session_id:
-        session_id = str(uuid.uuid4())
+        session_id = new_id()
 
-    if not sessions_collection.find_one({"session_id": session_id}):
-        add_session(session_id, f"Document: {file.filename}")
+    await ensure_session(session_id, f"Document: {file.filename}")
 
-    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as temp_file:
-        temp_path = temp_file.name
+    # UploadFile is already spooled, so parse it from memory instead of
+    # round-tripping through a temp file on disk
+    pdf_bytes = await file.read()
 
-        async with aiofiles.open(temp_path, "wb") as buffer:
-            chunk_size = 8192
-            while True:
-                chunk = await file.read(chunk_size)
-                if not chunk:
-                    break
-                await buffer.write(chunk)
+    # Parsing is CPU bound; run it off the event loop so other requests keep flowing
+    sections = await asyncio.to_thread(extract_pdf_sections, io.BytesIO(pdf_bytes))
 
-    try:
-        sections = extract_pdf_sections(temp_path)
-        total_tokens = await create_faiss_embeddings(sections, file_id, file.filename)
-
-        files_collection.insert_one(
-            {
-                "file_id": file_id,
-                "session_id": session_id,
-                "filename": file.filename,
-                "file_size": os.path.getsize(temp_path),
-                "total_sections": len(sections),
-                "total_tokens": total_tokens,
-                "upload_date": datetime.utcnow().isoformat(),
-                "status": "processed",
-            }
-        )
-
-        add_message(session_id, f"Uploaded: {file.filename}", "")
+    # Indexing runs alongside the summary stream and finishes even if the
+    # client disconnects mid-summary
+    index_task = _spawn(
+        _index_upload(sections, file_id, session_id, file.filename, len(pdf_bytes))
+    )
 
-        async def stream_summary():
-            yield f'data: {{"status": "session_id", "session_id": "{session_id}"}}\n\n'
+    await add_message(session_id, f"Uploaded: {file.filename}", "")
+    invalidate_history(session_id)
 
-            summary = ""
-            async for chunk in generate_document_summary(sections, file.filename):
-                summary += chunk
-                yield f'data: {{"status": "summary_chunk", "content": {json.dumps(chunk)} }}\n\n'
+    async def stream_summary():
+        yield (
+            b"data: "
+            + orjson.dumps({"status": "session_id", "session_id": session_id})
+            + b"\n\n"
+        )
 
-            add_message(session_id, "", summary)
-            yield 'data: {"status": "complete"}\n\n'
+        summary_parts = []
+        async for chunk in generate_document_summary(sections, file.filename):
+            summary_parts.append(chunk)
+            yield SSE_CHUNK_PREFIX + orjson.dumps(chunk) + SSE_CHUNK_SUFFIX
+
+        await add_message(session_id, "", "".join(summary_parts))
+        invalidate_history(session_id)
+
+        try:
+            await asyncio.shield(index_task)
+        except Exception as e:
+            logger.error(f"Failed to index uploaded file {file_id}: {e}")
+            yield (
+                b"data: "
+                + orjson.dumps(
+                    {
+                        "status": "error",
+                        "message": "The document could not be indexed for search.",
+                    }
+                )
+                + b"\n\n"
+            )
+            return
 
-        return StreamingResponse(stream_summary(), media_type="text/event-stream")
+        yield b'data: {"status": "complete"}\n\n'
 
-    finally:
-        os.unlink(temp_path)
+    return StreamingResponse(stream_summary(), media_type="text/event-stream")
 
 
 @app.get("/sessions/{session_id}/files")
 async def get_session_files(session_id: str):
     """Get files for a session."""
-    files = list(
-        files_collection.find({"session_id": session_id}, {"_id": 0}).sort(
-            "upload_date", -1
-        )
+    files = await (
+        files_collection.find({"session_id": session_id}, {"_id": 0})
+        .sort("upload_date", -1)
+        .to_list(None)
     )
     return {"files": files}
 
@@ -213,16 +460,13 @@ async def get_session_files(session_id: str):
 @app.get("/files/{file_id}")
 async def get_file_details(file_id: str):
     """Get file details."""
-    file_data = files_collection.find_one({"file_id": file_id}, {"_id": 0})
+    file_data = await files_collection.find_one({"file_id": file_id}, {"_id": 0})
     if not file_data:
         raise HTTPException(404, "File not found")
 
     # Get section count from FAISS metadata
-    try:
-        doc_info = get_document_info(file_id)
-        file_data["embeddings_count"] = doc_info.get("total_sections", 0)
-    except:
-        file_data["embeddings_count"] = 0
+    doc_info = await asyncio.to_thread(get_document_info, file_id) or {}
+    file_data["embeddings_count"] = doc_info.get("total_sections", 0)
 
     return {"file": file_data}
 
@@ -231,7 +475,7 @@ async def get_file_details(file_id: str):
 async def search_document(file_id: str, query: str):
     """Search within a specific document using FAISS."""
     try:
-        result = process_query_search(query, file_id)
+        result = await asyncio.to_thread(process_query_search, query, file_id)
         return result
     except Exception as e:
         raise HTTPException(500, f"Search failed: {str(e)}")
@@ -1,17 +1,17 @@
-from typing import Any, Dict, List, Optional
-from pydantic import BaseModel
+import operator
+from typing import Annotated, Any, Dict, List, TypedDict
 
-class GraphState(BaseModel):
+
+class GraphState(TypedDict, total=False):
     query: str
+    # Normalized query embedding, computed once per turn and reused by retrieval
+    query_vector: Any
     session_id: str
-    conversation_history: List[Dict[str, str]]
-    route_decision: Optional[str] = None
-    document_context: Optional[str] = None
-    response: Optional[str] = None
-    response_stream: Optional[Any] = None  
-    session_files: Optional[List[Dict]] = None
-    relevant_sections: Optional[List[Dict]] = None
-    error: Optional[str] = None
-    
-    class Config:
-        arbitrary_types_allowed = True  
+    conversation_history: Annotated[List[Dict[str, str]], operator.add]
+    route_decision: str
+    document_context: str
+    general_context: str
+    response: str
+    session_files: List[Dict]
+    relevant_sections: Annotated[List[Dict], operator.add]
+    error: str
@@ -1,12 +1,12 @@
 from langchain_core.prompts import ChatPromptTemplate
 from loguru import logger
 from langchain_core.output_parsers import StrOutputParser
+from services.llm import llm
 
-async def handle_general_query(state, llm):
-    """Handle general legal queries"""
-    try:
-        general_prompt = ChatPromptTemplate.from_template(
-            """
+_ROLE_LABELS = {"user": "User"}
+
+_GENERAL_PROMPT = ChatPromptTemplate.from_template(
+    """
         You are Lawroom AI, an AI assistant. Answer questions with accurate, helpful information.
         
         Conversation History:
@@ -31,24 +31,30 @@ async def handle_general_query(state, llm):
         
         Answer:
         """
-        )
+)
+
+_GENERAL_CHAIN = _GENERAL_PROMPT | llm | StrOutputParser()
 
-        conversation_context = ""
-        if state.conversation_history:
-            for msg in state.conversation_history[-6:]:
-                role = "User" if msg.get("role") == "user" else "Assistant"
-                conversation_context += f"{role}: {msg['message']}\n"
 
-        chain = general_prompt | llm | StrOutputParser()
-        state.response_stream = chain.astream({
+async def handle_general_query(state):
+    """Handle general legal queries"""
+    try:
+        conversation_context = "".join(
+            f"{_ROLE_LABELS.get(msg.get('role'), 'Assistant')}: {msg['message']}\n"
+            for msg in state.get("conversation_history", [])[-6:]
+        )
+
+        response = await _GENERAL_CHAIN.ainvoke({
             "conversation_history": conversation_context,
-            "query": state.query,
+            "query": state["query"],
         })
-        state.response = "General query processing complete."
+        return {
+            "response": response,
+        }
 
     except Exception as e:
         logger.error(f"Error in general query: {e}")
-        state.error = str(e)
-        state.response = "I encountered an error while processing your question. Please try again."
-
-    return state
\ No newline at end of file
+        return {
+            "error": str(e),
+            "response": "I encountered an error while processing your question. Please try again.",
+        }
\ No newline at end of file
@@ -1,40 +1,26 @@
-from utils.faiss_integration import search_similar_sections
+from config.config import RERANK_CANDIDATES
+from utils.faiss_integration import (
+    drop_near_duplicates,
+    prompt_tokenizer,
+    search_files,
+    truncate_to_tokens,
+)
+from utils.reranker import rerank, reranking_enabled
+import orjson
 from loguru import logger
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
+from services.llm import llm
 
-async def handle_hybrid_query(state, llm):
-    """Handle queries that benefit from both document context and general knowledge"""
-    try:
-        document_context = ""
-        if state.session_files:
-            all_relevant_sections = []
-            for file_info in state.session_files:
-                file_id = file_info["file_id"]
-                try:
-                    results = search_similar_sections(query=state.query, file_id=file_id, limit=3)
-                    if results:
-                        all_relevant_sections.extend(results)
-                except Exception as e:
-                    logger.error(f"Error searching file {file_id} in hybrid query: {e}")
-                    continue
-
-            all_relevant_sections.sort(key=lambda x: x.get("score", 0), reverse=True)
-            top_sections = all_relevant_sections[:3]
-
-            if top_sections:
-                context_parts = []
-                for section in top_sections:
-                    context_parts.append(f"""
-                    Document: {section.get('filename', 'Unknown')}
-                    Section: {section.get('section_title', 'Untitled')}
-                    Content: {section.get('content', '')[:500]}...
-                    Score: {section.get('score', 0):.3f}
-                    """)
-                document_context = "\n---\n".join(context_parts)
-
-        hybrid_prompt = ChatPromptTemplate.from_template(
-            """
+# Prompt size drives both latency and cost, so the context is capped at
+# CONTEXT_SECTIONS sections of at most SECTION_MAX_TOKENS tokens each
+CONTEXT_SECTIONS = 4
+SECTION_MAX_TOKENS = 800
+
+_ROLE_LABELS = {"user": "User"}
+
+_HYBRID_PROMPT = ChatPromptTemplate.from_template(
+    """
         You are LAW_GPT, a legal assistant. Answer the user's question using both the provided document context (if available) and your general legal knowledge.
         
         Document Context (if available):
@@ -46,7 +32,7 @@ async def handle_hybrid_query(state, llm):
         User Question: {query}
         
         Instructions:
-        1. If document context is available, reference it in your answer
+        1. If document context is available and relevant, reference it in your answer; if it is irrelevant to the question, ignore it and answer from general legal knowledge
         2. Supplement with general legal knowledge and principles
         3. Explain how the document relates to broader legal concepts
         4. Be comprehensive but concise
@@ -59,25 +45,79 @@ async def handle_hybrid_query(state, llm):
         
         Answer:
         """
+)
+
+_HYBRID_CHAIN = _HYBRID_PROMPT | llm | StrOutputParser()
+
+
+async def retrieve_doc_context(state):
+    """Retrieve document context for a hybrid query"""
+    try:
+        if not state.get("session_files"):
+            return {"document_context": ""}
+
+        # One search over the global index, already sorted best first; with a
+        # reranker configured, a wider candidate set is narrowed down. Spare
+        # candidates replace sections dropped as near-duplicates.
+        candidates = await search_files(
+            state["query"],
+            [file_info["file_id"] for file_info in state["session_files"]],
+            limit=RERANK_CANDIDATES if reranking_enabled() else CONTEXT_SECTIONS * 2,
+            query_vector=state.get("query_vector"),
+        )
+        top_sections = await rerank(
+            state["query"], drop_near_duplicates(candidates), CONTEXT_SECTIONS
         )
 
-        conversation_context = ""
-        if state.conversation_history:
-            for msg in state.conversation_history[-6:]:
-                role = "User" if msg.get("role") == "user" else "Assistant"
-                conversation_context += f"{role}: {msg['message']}\n"
+        document_context = orjson.dumps(
+            [
+                {
+                    "doc": section.get("filename", "Unknown"),
+                    "section": section.get("section_title", "Untitled"),
+                    "content": truncate_to_tokens(
+                        section.get("content", ""), SECTION_MAX_TOKENS, prompt_tokenizer
+                    ),
+                    "score": round(section.get("score", 0), 3),
+                }
+                for section in top_sections
+            ]
+        ).decode() if top_sections else ""
 
-        chain = hybrid_prompt | llm | StrOutputParser()
-        state.response_stream = chain.astream({
+        return {
+            "relevant_sections": top_sections,
             "document_context": document_context,
-            "conversation_history": conversation_context,
-            "query": state.query,
+        }
+
+    except Exception as e:
+        logger.error(f"Error retrieving document context in hybrid query: {e}")
+        return {"document_context": "", "error": str(e)}
+
+
+async def prefetch_general_context(state):
+    """Prepare the conversation context while documents are being searched"""
+    conversation_context = "".join(
+        f"{_ROLE_LABELS.get(msg.get('role'), 'Assistant')}: {msg['message']}\n"
+        for msg in state.get("conversation_history", [])[-6:]
+    )
+
+    return {"general_context": conversation_context}
+
+
+async def generate_with_context(state):
+    """Answer using both the retrieved document context and general knowledge"""
+    try:
+        response = await _HYBRID_CHAIN.ainvoke({
+            "document_context": state.get("document_context", ""),
+            "conversation_history": state.get("general_context", ""),
+            "query": state["query"],
         })
-        state.response = "Hybrid analysis complete."
+        return {
+            "response": response,
+        }
 
     except Exception as e:
         logger.error(f"Error in hybrid query: {e}")
-        state.error = str(e)
-        state.response = "I encountered an error while processing your question. Please try again."
-
-    return state
+        return {
+            "error": str(e),
+            "response": "I encountered an error while processing your question. Please try again.",
+        }
@@ -1,53 +1,20 @@
-from utils.dataBase_integration import files_collection
+from utils.dataBase_integration import get_session_file_refs
 from loguru import logger
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
 
-async def route_query(state, llm):
-    """Determine if query is document-specific, general, or hybrid"""
-    try:
-        session_files = list(
-            files_collection.find(
-                {"session_id": state.session_id},
-                {"_id": 0, "file_id": 1, "filename": 1},
-            )
-        )
-        state.session_files = session_files
-
-        if not session_files:
-            state.route_decision = "general"
-            return state
 
-        routing_prompt = ChatPromptTemplate.from_template(
-            """
-        Analyze this user query and determine the best routing strategy:
-        
-        User Query: {query}
-        Available Documents: {file_list}
-        
-        Classify as:
-        - "document": Query is specifically about uploaded documents
-        - "general": Query is about general legal knowledge
-        - "hybrid": Query could benefit from both document context AND general legal knowledge
-        
-        Respond with only: document, general, or hybrid
-        """
-        )
+async def route_query(state):
+    """Route to hybrid when the session has documents, general otherwise.
 
-        file_list = [f["filename"] for f in session_files]
-        chain = routing_prompt | llm | StrOutputParser()
-        decision = await chain.ainvoke({
-            "query": state.query,
-            "file_list": ", ".join(file_list) if file_list else "None",
-        })
+    Retrieval over HNSW is cheap next to an extra LLM round trip, so instead of
+    asking the model to classify the query, document context is always fetched
+    and the hybrid prompt tells the model to ignore it when it isn't relevant.
+    """
+    try:
+        session_files = await get_session_file_refs(state["session_id"])
 
-        state.route_decision = decision.strip().lower()
-        if state.route_decision not in ["document", "general", "hybrid"]:
-            state.route_decision = "general"
+        route_decision = "hybrid" if session_files else "general"
+        return {"session_files": session_files, "route_decision": route_decision}
 
     except Exception as e:
         logger.error(f"Error in routing: {e}")
-        state.route_decision = "general"
-        state.error = str(e)
-
-    return state
+        return {"route_decision": "general", "error": str(e)}
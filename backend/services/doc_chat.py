@@ -1,34 +1,15 @@
 from typing import AsyncGenerator
 import asyncio
-from langchain_openai import ChatOpenAI
-from typing import List, Dict
+from typing import List, Dict, Optional
 from langchain_core.output_parsers import StrOutputParser
-from config.config import OPENAI_API_KEY
-from utils.faiss_integration import count_tokens
+from langchain_core.prompts import PromptTemplate
+from services.llm import llm
+from services.llm_cache import llm_cache
+from utils.faiss_integration import count_tokens, prompt_tokenizer, truncate_to_tokens
 from loguru import logger
 
-llm_summary = ChatOpenAI(
-    api_key=OPENAI_API_KEY,
-    model="gpt-4o-mini",
-    temperature=0.1,
-    streaming=True,
-)
-
-
-async def generate_document_summary(
-    sections: List[Dict], file_name: str
-) -> AsyncGenerator[str, None]:
-    """Stream the generation of a clean, formatted legal document summary."""
-
-    content_preview = ""
-    section_titles = []
-
-    for section in sections[:10]:  # First 10 sections for context
-        section_titles.append(section["section_title"])
-        content_preview += f"Section: {section['section_title']}\n"
-        content_preview += f"Content: {section['content'][:200]}...\n\n"
-
-    summary_prompt = f"""
+_SUMMARY_PROMPT = PromptTemplate.from_template(
+    """
     Analyze this legal document and provide a clean, well-formatted summary using markdown formatting.
     
     Document: {file_name}
@@ -66,22 +47,95 @@ async def generate_document_summary(
     3. Ensure each section is clearly separated with line breaks
     4. Use ### for section headers and maintain consistent formatting
     """
+)
 
-    try:
-        chain = llm_summary | StrOutputParser()
+_SUMMARY_CHAIN = _SUMMARY_PROMPT | llm | StrOutputParser()
+
+# Token usage is counted and logged in batches by a single background task
+TOKEN_LOG_BATCH_SIZE = 32
+_token_queue: asyncio.Queue = asyncio.Queue()
+_token_drain_task: Optional[asyncio.Task] = None
+
+
+async def _token_drain():
+    """Count queued summary texts in batches and log the aggregate usage."""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await _token_queue.get()]
+        while len(batch) < TOKEN_LOG_BATCH_SIZE and not _token_queue.empty():
+            batch.append(_token_queue.get_nowait())
 
-        full_output = ""
+        text = "".join(preview + output for preview, output in batch)
+        try:
+            total_tokens = await loop.run_in_executor(
+                None, count_tokens, text, prompt_tokenizer
+            )
+            logger.info(
+                f"Summary generation used {total_tokens} tokens across {len(batch)} summaries"
+            )
+        except Exception as e:
+            logger.error(f"Error counting summary tokens: {e}")
+
+
+def _log_summary_tokens(content_preview: str, full_output: str):
+    global _token_drain_task
+    if _token_drain_task is None or _token_drain_task.done():
+        _token_drain_task = asyncio.create_task(_token_drain())
+    _token_queue.put_nowait((content_preview, full_output))
+
+
+# The preview is bounded by tokens rather than a fixed section/char count; the
+# budget matches the size of the original ten 200-character section previews
+PREVIEW_TOKEN_BUDGET = 700
+PREVIEW_SECTION_TOKENS = 70
+
+
+def _build_content_preview(sections: List[Dict]) -> str:
+    """Take leading sections, each truncated, until the token budget is spent."""
+    parts = []
+    used = 0
+    for section in sections:
+        content = truncate_to_tokens(
+            section["content"], PREVIEW_SECTION_TOKENS, prompt_tokenizer
+        )
+        part = f"Section: {section['section_title']}\nContent: {content}\n\n"
+        tokens = count_tokens(part, prompt_tokenizer)
+        if parts and used + tokens > PREVIEW_TOKEN_BUDGET:
+            break
+        parts.append(part)
+        used += tokens
+    return "".join(parts)
+
+
+async def generate_document_summary(
+    sections: List[Dict], file_name: str
+) -> AsyncGenerator[str, None]:
+    """Stream the generation of a clean, formatted legal document summary."""
+
+    content_preview = _build_content_preview(sections)
+    prompt_values = {"file_name": file_name, "content_preview": content_preview}
+
+    try:
+        # Re-uploads of the same document render the same prompt
+        cache_key = None
+        if llm_cache:
+            cache_key = llm_cache.key(llm.model_name, _SUMMARY_PROMPT.format(**prompt_values))
+            cached = await llm_cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"Summary cache hit for {file_name}")
+                yield cached
+                return
 
-        async for chunk in chain.astream(summary_prompt):
-            full_output += chunk
-            yield chunk  
+        output_parts = []
 
-        # Background logging of token usage (non-blocking)
-        async def log_tokens():
-            total_tokens = count_tokens(content_preview) + count_tokens(full_output)
-            logger.info(f"Summary generation used {total_tokens} tokens")
+        async for chunk in _SUMMARY_CHAIN.astream(prompt_values):
+            output_parts.append(chunk)
+            yield chunk
 
-        asyncio.create_task(log_tokens())
+        full_output = "".join(output_parts)
+        _log_summary_tokens(content_preview, full_output)
+        if cache_key:
+            await llm_cache.set(cache_key, full_output)
 
     except Exception as e:
         logger.error(f"Error generating summary: {e}")
@@ -0,0 +1,23 @@
+import httpx
+from langchain_openai import ChatOpenAI
+from loguru import logger
+from config.config import OPENAI_API_KEY
+
+# Shared HTTP/2 connection pool for every OpenAI call made by the app
+http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+    timeout=60,
+)
+
+# Single streaming client used by the graph nodes, the chat fallback,
+# session titles and document summaries
+llm = ChatOpenAI(
+    api_key=OPENAI_API_KEY,
+    model="gpt-4o-mini",
+    temperature=0.1,
+    streaming=True,
+    http_async_client=http_client,
+)
+
+logger.info(f"OpenAI LLM client initialized: {llm}")
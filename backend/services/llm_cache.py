@@ -0,0 +1,86 @@
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from loguru import logger
+
+from config.config import LLM_CACHE_PATH, LLM_CACHE_TTL
+
+
+# Expired rows are deleted on open and then once every this many writes
+PURGE_EVERY_WRITES = 500
+
+
+class LLMResponseCache:
+    """Exact-match cache of LLM responses keyed by a hash of the rendered prompt."""
+
+    def __init__(self, path: str, ttl: int = LLM_CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT, ts INTEGER)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_ts ON llm_cache (ts)")
+        self._conn.commit()
+        with self._lock:
+            self._purge_expired()
+
+    @staticmethod
+    def key(model: str, prompt: str) -> str:
+        return hashlib.sha256(f"{model}\0{prompt}".encode()).hexdigest()
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM llm_cache WHERE key = ? AND ts >= ?",
+                (key, int(time.time()) - self.ttl),
+            ).fetchone()
+        return row[0] if row else None
+
+    def _purge_expired(self):
+        """Delete rows past the TTL; the caller holds the lock."""
+        deleted = self._conn.execute(
+            "DELETE FROM llm_cache WHERE ts < ?", (int(time.time()) - self.ttl,)
+        ).rowcount
+        self._conn.commit()
+        if deleted:
+            logger.info(f"Purged {deleted} expired LLM cache entries")
+
+    def _set(self, key: str, value: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, ts) VALUES (?, ?, ?)",
+                (key, value, int(time.time())),
+            )
+            self._conn.commit()
+            self._writes += 1
+            if self._writes % PURGE_EVERY_WRITES == 0:
+                self._purge_expired()
+
+    async def get(self, key: str) -> Optional[str]:
+        try:
+            return await asyncio.to_thread(self._get, key)
+        except Exception as e:
+            logger.error(f"LLM cache read failed: {e}")
+            return None
+
+    async def set(self, key: str, value: str):
+        try:
+            await asyncio.to_thread(self._set, key, value)
+        except Exception as e:
+            logger.error(f"LLM cache write failed: {e}")
+
+
+# Global instance; None when the cache is disabled or the file can't be opened
+llm_cache: Optional[LLMResponseCache] = None
+if LLM_CACHE_PATH:
+    try:
+        llm_cache = LLMResponseCache(LLM_CACHE_PATH)
+    except Exception as e:
+        logger.error(f"Failed to open LLM cache at {LLM_CACHE_PATH}, caching disabled: {e}")
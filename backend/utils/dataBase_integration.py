@@ -1,46 +1,145 @@
-from pymongo import MongoClient
+from cachetools import TTLCache
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import OperationFailure
 from datetime import datetime
 from config.config import MONGODB_URI
 from loguru import logger
 from typing import Optional, List, Dict, Any
 
-# MongoDB setup
-client = MongoClient(MONGODB_URI)
+# MongoDB setup. Timestamps are stored as native BSON dates (naive UTC);
+# responses are encoded by orjson, which writes them in the same ISO 8601
+# form the old string fields used
+client = AsyncIOMotorClient(MONGODB_URI)
 db = client["chatbot_db2"]
 conversations_collection = db["conversations"]
 sessions_collection = db["sessions"]
 files_collection = db["files"]
 
-# Create indexes for better performance
-try:
-    files_collection.create_index("file_id")
-    files_collection.create_index("upload_date")
-    sessions_collection.create_index("session_id")
-    sessions_collection.create_index("created_at")
-    conversations_collection.create_index("session_id")
-    conversations_collection.create_index("created_at")
-    logger.info("Database indexes created successfully")
-except Exception as e:
-    logger.warning(f"Index creation warning: {e}")
-
-def add_session(session_id: str, title: str) -> str:
+# session_id -> [{"file_id", "filename"}] for routing; uploads drop their session's entry
+SESSION_FILES_TTL = 60
+_session_files_cache = TTLCache(maxsize=1024, ttl=SESSION_FILES_TTL)
+# session_id -> invalidation count, so a lookup that raced an upload does not
+# cache the list it read before the upload; an evicted count reads as changed
+_session_files_generation = TTLCache(maxsize=4096, ttl=SESSION_FILES_TTL)
+
+async def create_indexes():
+    """Create indexes for better performance."""
+    try:
+        await files_collection.create_index("file_id")
+        await files_collection.create_index([("session_id", 1), ("upload_date", -1)])
+        # Covers get_session_file_refs, which routing runs on every turn
+        await files_collection.create_index(
+            [("session_id", 1), ("file_id", 1), ("filename", 1)]
+        )
+        await sessions_collection.create_index("created_at")
+        # History is read per session in _id order, both ways
+        await conversations_collection.create_index([("session_id", 1), ("_id", 1)])
+        logger.info("Database indexes created successfully")
+    except Exception as e:
+        logger.warning(f"Index creation warning: {e}")
+    # Each step runs on its own so one failing does not skip the others
+    try:
+        await _create_unique_session_index()
+    except Exception as e:
+        logger.warning(f"Unique session index warning: {e}")
+    try:
+        await _drop_redundant_indexes()
+    except Exception as e:
+        logger.warning(f"Redundant index cleanup warning: {e}")
+
+async def _create_unique_session_index():
+    """Make session_id unique, replacing the older non-unique index if present.
+
+    The old index is only dropped once no duplicate session_id values exist,
+    and restored if the unique build still fails, so lookups by session_id
+    never lose their index.
+    """
+    existing = await sessions_collection.index_information()
+    old = existing.get("session_id_1")
+    if old is None:
+        await sessions_collection.create_index("session_id", unique=True)
+        return
+    if old.get("unique"):
+        return
+
+    duplicates = await sessions_collection.aggregate(
+        [
+            {"$group": {"_id": "$session_id", "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}},
+            {"$limit": 1},
+        ]
+    ).to_list(1)
+    if duplicates:
+        logger.error(
+            f"Duplicate session_id {duplicates[0]['_id']!r} in sessions; keeping "
+            "the non-unique index until duplicates are removed"
+        )
+        return
+
+    await sessions_collection.drop_index("session_id_1")
+    try:
+        await sessions_collection.create_index("session_id", unique=True)
+    except OperationFailure:
+        # 11000: a duplicate was inserted after the check above
+        await sessions_collection.create_index("session_id")
+        raise
+
+# Single-field indexes from earlier versions that no query uses, or that are a
+# prefix of a compound index above; dropping them saves index RAM and write cost
+REDUNDANT_INDEXES = [
+    (files_collection, ["upload_date_1"]),
+    (conversations_collection, ["session_id_1", "created_at_1"]),
+]
+
+async def _drop_redundant_indexes():
+    """Drop indexes listed in REDUNDANT_INDEXES that still exist."""
+    for collection, names in REDUNDANT_INDEXES:
+        existing = await collection.index_information()
+        for name in names:
+            if name in existing:
+                await collection.drop_index(name)
+                logger.info(f"Dropped redundant index {collection.name}.{name}")
+
+async def add_session(session_id: str, title: str) -> str:
     """Add a new session to the database."""
-    sessions_collection.insert_one(
+    await sessions_collection.insert_one(
         {
             "session_id": session_id,
             "title": title,
-            "created_at": datetime.utcnow().isoformat(),
+            "created_at": datetime.utcnow(),
         }
     )
     return title
 
-def add_message(session_id: str, user_message: str, ai_message: str):
+async def ensure_session(session_id: str, title: str) -> bool:
+    """Create the session if it doesn't exist. Returns True if it was inserted."""
+    result = await sessions_collection.update_one(
+        {"session_id": session_id},
+        {
+            "$setOnInsert": {
+                "session_id": session_id,
+                "title": title,
+                "created_at": datetime.utcnow(),
+            }
+        },
+        upsert=True,
+    )
+    return result.upserted_id is not None
+
+async def update_session_title(session_id: str, title: str):
+    """Update the title of an existing session."""
+    await sessions_collection.update_one(
+        {"session_id": session_id}, {"$set": {"title": title}}
+    )
+
+async def add_message(session_id: str, user_message: str, ai_message: str):
     """Add user and AI messages to the conversation."""
-    timestamp = datetime.utcnow().isoformat()
+    timestamp = datetime.utcnow()
     logger.info(f"Adding message to session {session_id} at {timestamp}")
 
+    docs = []
     if user_message:
-        conversations_collection.insert_one(
+        docs.append(
             {
                 "session_id": session_id,
                 "role": "user",
@@ -48,9 +147,8 @@ def add_message(session_id: str, user_message: str, ai_message: str):
                 "created_at": timestamp,
             }
         )
-    
     if ai_message:
-        conversations_collection.insert_one(
+        docs.append(
             {
                 "session_id": session_id,
                 "role": "ai",
@@ -59,60 +157,88 @@ def add_message(session_id: str, user_message: str, ai_message: str):
             }
         )
 
-    return {"status": "success", "message": "Message added successfully."}
+    # Both messages of a turn go in one round trip; ObjectIds are assigned in
+    # list order, so history sorted by _id still has the user message first
+    last_id = None
+    if docs:
+        result = await conversations_collection.insert_many(docs)
+        last_id = result.inserted_ids[-1]
+
+    return {
+        "status": "success",
+        "message": "Message added successfully.",
+        "last_id": last_id,
+        "created_at": timestamp,
+    }
 
-def fetch_all_conversations(session_id: str):
+async def fetch_all_conversations(session_id: str):
     """Fetch all conversations for a session."""
-    messages = list(
-        conversations_collection.find({"session_id": session_id}).sort("created_at", 1)
-    )
-    result = []
-    for msg in messages:
-        result.append(
-            {
-                "role": msg.get("role"),
-                "message": msg.get("message"),
-                "created_at": msg.get("created_at"),
-            }
+    return await (
+        conversations_collection.find(
+            {"session_id": session_id},
+            {"_id": 0, "role": 1, "message": 1, "created_at": 1},
         )
-    return result
+        .sort("_id", 1)
+        .to_list(None)
+    )
 
-def get_all_sessions_sorted() -> list:
+async def get_all_sessions_sorted() -> list:
     """Get all sessions sorted by creation time."""
-    sessions = list(
+    sessions = await (
         sessions_collection.find(
             {}, {"_id": 0, "session_id": 1, "title": 1, "created_at": 1}
-        ).sort("created_at", -1)
+        )
+        .sort("created_at", -1)
+        .to_list(None)
     )
     return sessions
 
-def get_file_metadata(file_id: str) -> Optional[Dict]:
+async def get_file_metadata(file_id: str) -> Optional[Dict]:
     """Get file metadata from MongoDB."""
     try:
-        return files_collection.find_one({"file_id": file_id}, {"_id": 0})
+        return await files_collection.find_one({"file_id": file_id}, {"_id": 0})
     except Exception as e:
         logger.error(f"Error fetching file metadata: {e}")
         return None
 
-def update_file_status(file_id: str, status: str):
+async def update_file_status(file_id: str, status: str):
     """Update file processing status."""
     try:
-        files_collection.update_one(
+        await files_collection.update_one(
             {"file_id": file_id},
-            {"$set": {"status": status, "updated_at": datetime.utcnow().isoformat()}},
+            {"$set": {"status": status, "updated_at": datetime.utcnow()}},
         )
     except Exception as e:
         logger.error(f"Error updating file status: {e}")
 
-def get_session_files(session_id: str) -> List[Dict]:
+async def get_session_files(session_id: str) -> List[Dict]:
     """Get all files for a session."""
     try:
-        files = list(
-            files_collection.find({"session_id": session_id}, {"_id": 0}).sort(
-                "upload_date", -1
-            )
+        files = await (
+            files_collection.find({"session_id": session_id}, {"_id": 0})
+            .sort("upload_date", -1)
+            .to_list(None)
         )
         return files
     except Exception as e:
         logger.error(f"Error fetching session files: {e}")
-        return []
\ No newline at end of file
+        return []
+
+async def get_session_file_refs(session_id: str) -> List[Dict]:
+    """Get the ids and names of a session's files, cached per session."""
+    files = _session_files_cache.get(session_id)
+    if files is None:
+        generation = _session_files_generation.get(session_id, 0)
+        files = await files_collection.find(
+            {"session_id": session_id}, {"_id": 0, "file_id": 1, "filename": 1}
+        ).to_list(None)
+        if _session_files_generation.get(session_id, 0) == generation:
+            _session_files_cache[session_id] = files
+    return files
+
+def invalidate_session_files(session_id: str):
+    """Forget the cached file list after a session's files change."""
+    _session_files_cache.pop(session_id, None)
+    _session_files_generation[session_id] = (
+        _session_files_generation.get(session_id, 0) + 1
+    )
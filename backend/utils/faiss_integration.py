@@ -1,16 +1,25 @@
+import asyncio
+import io
 import os
 import pickle
 import json
+import multiprocessing
 import re
+import threading
 from pathlib import Path
-from typing import List, Dict, Any, Optional
-from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, BinaryIO, Tuple, Union
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache, partial
+from itertools import repeat
+from cachetools import TTLCache
 import numpy as np
 from loguru import logger
 
 import faiss
 from langchain_openai import OpenAIEmbeddings
-from config.config import OPENAI_API_KEY
+from config.config import EMBEDDING_DIMENSIONS, OPENAI_API_KEY
+from services.llm import http_client
 
 # PDF processing imports
 import PyPDF2
@@ -18,19 +27,63 @@ import tiktoken
 from typing import List, Dict, Any
 
 embeddings_model = OpenAIEmbeddings(
-    api_key=OPENAI_API_KEY, model="text-embedding-3-small"
+    api_key=OPENAI_API_KEY,
+    model="text-embedding-3-small",
+    dimensions=EMBEDDING_DIMENSIONS or None,
+    # Send each packed batch as one request instead of langchain's default 1000
+    chunk_size=2048,
+    # Embedding calls share the chat model's HTTP/2 pool instead of their own
+    http_async_client=http_client,
 )
 
+
+NATIVE_EMBEDDING_DIMENSIONS = 1536
+EMBEDDING_DIMENSION = EMBEDDING_DIMENSIONS or NATIVE_EMBEDDING_DIMENSIONS
+
+
+def _check_dimension(index, name: str):
+    """Reject indexes built at a different embedding size than queries now use."""
+    if index.d != EMBEDDING_DIMENSION:
+        raise ValueError(
+            f"FAISS index {name} has {index.d} dimensions but embeddings are "
+            f"configured for {EMBEDDING_DIMENSION}; re-upload the document"
+        )
+
 # Initialize tokenizer for counting tokens
 try:
     tokenizer = tiktoken.get_encoding("cl100k_base")
 except:
     tokenizer = None
 
+# gpt-4o models tokenize prompts with o200k_base; cl100k_base above matches
+# the embedding model and is used for sections
+try:
+    prompt_tokenizer = tiktoken.get_encoding("o200k_base")
+except:
+    prompt_tokenizer = tokenizer
+
 
 FAISS_INDEX_DIR = Path("Faiss_index")
 FAISS_INDEX_DIR.mkdir(exist_ok=True)
 
+try:
+    import psutil
+    PHYSICAL_CORES = psutil.cpu_count(logical=False) or os.cpu_count() or 1
+except ImportError:
+    PHYSICAL_CORES = os.cpu_count() or 1
+
+# FAISS releases the GIL while searching, so searches on this pool run in
+# parallel without stalling the event loop. The pool already supplies one
+# thread per core; OpenMP inside each call (e.g. reconstruct_batch past 1000
+# ids) would multiply that to cores² threads, so it is held to one
+faiss.omp_set_num_threads(1)
+_faiss_pool = ThreadPoolExecutor(max_workers=PHYSICAL_CORES, thread_name_prefix="faiss")
+
+# HNSW graph parameters shared by the per-file and global indexes
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
 
 def get_file_paths(file_id: str):
     """Get file paths for FAISS index and metadata."""
@@ -40,74 +93,84 @@ def get_file_paths(file_id: str):
     }
 
 
-def create_embedding_batch(batch_data):
-    """Create embeddings for a batch of sections."""
-    batch_sections, start_idx = batch_data
-    batch_embeddings = []
+def new_hnsw_index(dimension: int, qtype=None):
+    """HNSW index over normalized vectors, so inner product is cosine similarity.
 
-    for i, section in enumerate(batch_sections):
-        try:
-            embedding = embeddings_model.embed_query(section["content"])
-            batch_embeddings.append({"embedding": embedding, "index": start_idx + i})
-        except Exception as e:
-            logger.error(f"Error creating embedding for section {start_idx + i}: {e}")
-            continue
+    Vectors are stored scalar-quantized to ``qtype``; 8-bit codes need ``train``.
+    """
+    if qtype is None:
+        qtype = faiss.ScalarQuantizer.QT_8bit
+    index = faiss.IndexHNSWSQ(dimension, qtype, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    return index
 
-    return batch_embeddings
 
+# The embeddings endpoint accepts up to 2048 inputs and ~300k tokens per
+# request; batches are packed close to that so large PDFs need few round trips
+EMBEDDING_BATCH_TOKENS = 250_000
+EMBEDDING_BATCH_MAX_INPUTS = 2048
+EMBEDDING_CONCURRENCY = 8
 
-async def create_faiss_embeddings(
-    sections: List[Dict], file_id: str, filename: str
-) -> int:
-    """Create FAISS embeddings with parallel processing."""
-    logger.info(f"Creating FAISS embeddings for {len(sections)} sections")
 
-    # Prepare batches of 10 sections
+def _pack_embedding_batches(sections: List[Dict]) -> List[List[int]]:
+    """Group section indices into batches that stay within the token budget."""
     batches = []
-    for i in range(0, len(sections), 10):
-        batch = sections[i : i + 10]
-        batches.append((batch, i))
-
-    # Process batches in parallel with 4 workers
-    all_embeddings = []
-    metadata = []
-
-    with ThreadPoolExecutor(max_workers=4) as executor:
-        results = list(executor.map(create_embedding_batch, batches))
-
-    for batch_result in results:
-        for item in batch_result:
-            all_embeddings.append(item["embedding"])
-            section_data = sections[item["index"]]
-
-            # Extract metadata
-            metadata.append(
-                {
-                    "section_index": item["index"],
-                    "section_title": section_data.get("section_title", ""),
-                    "content": section_data.get("content", ""),
-                    "page_start": section_data.get("page_start", 0),
-                    "page_end": section_data.get("page_end", 0),
-                    "token_count": section_data.get("token_count", 0),
-                    "hierarchy_level": section_data.get("hierarchy_level", 0),
-                    "contains_definitions": None,
-                    "contains_obligations": None,
-                    "contains_dates": None,
-                    "file_id": file_id,
-                    "filename": filename,
-                }
-            )
+    current = []
+    current_tokens = 0
+    for i, section in enumerate(sections):
+        tokens = section.get("token_count") or count_tokens(section["content"])
+        if current and (
+            current_tokens + tokens > EMBEDDING_BATCH_TOKENS
+            or len(current) >= EMBEDDING_BATCH_MAX_INPUTS
+        ):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+async def embed_sections(sections: List[Dict]) -> Tuple[List[int], np.ndarray]:
+    """Embed sections in token-budgeted batches.
+
+    Returns the embedded section indices in order and their vectors as one
+    float32 array. Each batch is converted as it arrives: a 1536-d vector is
+    ~6 KB as float32 but ~50 KB as a list of Python floats.
+    """
+    semaphore = asyncio.Semaphore(EMBEDDING_CONCURRENCY)
+
+    async def embed_batch(batch: List[int]):
+        async with semaphore:
+            try:
+                vectors = await embeddings_model.aembed_documents(
+                    [sections[i]["content"] for i in batch]
+                )
+                return batch, np.asarray(vectors, dtype="float32")
+            except Exception as e:
+                logger.error(
+                    f"Error creating embeddings for sections {batch[0]}-{batch[-1]}: {e}"
+                )
+                return None
+
+    results = await asyncio.gather(
+        *(embed_batch(batch) for batch in _pack_embedding_batches(sections))
+    )
+    results = [result for result in results if result is not None]
+    if not results:
+        return [], np.empty((0, 0), dtype="float32")
+    indices = [i for batch, _ in results for i in batch]
+    return indices, np.concatenate([vectors for _, vectors in results])
 
-    if not all_embeddings:
-        logger.error("No embeddings created")
-        return 0
 
-    dimension = len(all_embeddings[0])
-    index = faiss.IndexFlatIP(dimension)  # Inner product for cosine similarity
-
-    embeddings_array = np.array(all_embeddings).astype("float32")
-    faiss.normalize_L2(embeddings_array)
+def _build_and_store_index(file_id: str, embeddings_array: np.ndarray, metadata: Dict):
+    """Train and write the per-file index and metadata, then add the file to the global index."""
+    index = new_hnsw_index(embeddings_array.shape[1])
 
+    # SQ8 learns per-dimension ranges from the file's own vectors
+    index.train(embeddings_array)
     index.add(embeddings_array)
 
     paths = get_file_paths(file_id)
@@ -116,10 +179,89 @@ async def create_faiss_embeddings(
     with open(paths["metadata"], "wb") as f:
         pickle.dump(metadata, f)
 
-    logger.info(f"Created FAISS index with {len(all_embeddings)} embeddings")
-    return sum(item["token_count"] for item in metadata)
+    try:
+        get_global_index().add_file(file_id, embeddings_array)
+    except Exception as e:
+        # Searches fall back to the per-file index for files missing here
+        logger.error(f"Failed to add file {file_id} to the global FAISS index: {e}")
 
 
+async def create_faiss_embeddings(
+    sections: List[Dict], file_id: str, filename: str
+) -> int:
+    """Create FAISS embeddings with batched, concurrent embedding requests."""
+    logger.info(f"Creating FAISS embeddings for {len(sections)} sections")
+
+    metadata = []
+
+    section_indices, embeddings_array = await embed_sections(sections)
+    for section_index in section_indices:
+        section_data = sections[section_index]
+
+        # Extract metadata
+        metadata.append(
+            {
+                "section_index": section_index,
+                "section_title": section_data.get("section_title", ""),
+                "content": section_data.get("content", ""),
+                "page_start": section_data.get("page_start", 0),
+                "page_end": section_data.get("page_end", 0),
+                "token_count": section_data.get("token_count", 0),
+                "hierarchy_level": section_data.get("hierarchy_level", 0),
+            }
+        )
+
+    if not section_indices:
+        logger.error("No embeddings created")
+        return 0
+
+    faiss.normalize_L2(embeddings_array)
+
+    # Document-level fields are stored once rather than repeated on every section
+    total_tokens = sum(item["token_count"] for item in metadata)
+    file_fields = {
+        "file_id": file_id,
+        "filename": filename,
+        "total_sections": len(metadata),
+        "total_pages": max(item["page_end"] for item in metadata),
+        "total_tokens": total_tokens,
+    }
+
+    # Training, adding and writing the index are CPU/disk bound; keep them off the event loop
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(
+        _faiss_pool,
+        _build_and_store_index,
+        file_id,
+        embeddings_array,
+        {"file": file_fields, "sections": metadata},
+    )
+
+    logger.info(f"Created FAISS index with {len(section_indices)} embeddings")
+    return total_tokens
+
+
+def _read_metadata(path: Path) -> Tuple[Dict, List[Dict]]:
+    """Load a metadata pickle as (document-level fields, sections)."""
+    with open(path, "rb") as f:
+        data = pickle.load(f)
+    # Older files are a plain list whose sections carry file_id and filename
+    if isinstance(data, list):
+        return {}, data
+    return data["file"], data["sections"]
+
+
+def _section_hit(file_fields: Dict, section: Dict, score: float) -> Dict:
+    """Build a search result from a stored section and its document's fields."""
+    hit = dict(section, score=score)
+    if file_fields:
+        hit["file_id"] = file_fields["file_id"]
+        hit["filename"] = file_fields["filename"]
+    return hit
+
+
+# Per-file indexes are immutable once written, so each is read from disk once
+@lru_cache(maxsize=64)
 def load_faiss_index(file_id: str):
     """Load FAISS index and metadata for a file."""
     paths = get_file_paths(file_id)
@@ -128,11 +270,38 @@ def load_faiss_index(file_id: str):
         raise FileNotFoundError(f"FAISS index not found for file {file_id}")
 
     index = faiss.read_index(str(paths["index"]))
+    _check_dimension(index, file_id)
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+
+    file_fields, sections = _read_metadata(paths["metadata"])
+    return index, file_fields, sections
+
+
+def _search_file(
+    query: str, file_id: str, limit: int, query_vector: Optional[np.ndarray] = None
+) -> List[Dict]:
+    """Search one file's own index; raises if the index can't be used.
+
+    The query is embedded here only when no normalized ``query_vector`` is given.
+    """
+    index, file_fields, metadata = load_faiss_index(file_id)
+
+    if query_vector is None:
+        query_embedding = embeddings_model.embed_query(query)
+        query_vector = np.array([query_embedding]).astype("float32")
+        faiss.normalize_L2(query_vector)
 
-    with open(paths["metadata"], "rb") as f:
-        metadata = pickle.load(f)
+    scores, indices = index.search(query_vector, limit)
 
-    return index, metadata
+    # One tolist() per row instead of a numpy scalar box per hit
+    results = []
+    for idx, score in zip(indices[0].tolist(), scores[0].tolist()):
+        # HNSW pads with -1 when it finds fewer than `limit` neighbours
+        if 0 <= idx < len(metadata):
+            results.append(_section_hit(file_fields, metadata[idx], score))
+
+    return results
 
 
 def search_similar_sections(
@@ -142,45 +311,422 @@ def search_similar_sections(
     try:
         if not file_id:
             raise ValueError("file_id is required for FAISS search")
+        return _search_file(query, file_id, limit)
 
-        index, metadata = load_faiss_index(file_id)
+    except Exception as e:
+        logger.error(f"Error in FAISS search: {e}")
+        return []
 
-        query_embedding = embeddings_model.embed_query(query)
-        query_vector = np.array([query_embedding]).astype("float32")
-        faiss.normalize_L2(query_vector)
 
-        scores, indices = index.search(query_vector, limit)
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first, without a full sort."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
 
-        results = []
-        for i, idx in enumerate(indices[0]):
-            if idx < len(metadata):
-                result = metadata[idx].copy()
-                result["score"] = float(scores[0][i])
-                results.append(result)
 
-        return results
+def top_k_by_score(sections: List[Dict], k: int) -> List[Dict]:
+    """Best k sections by their "score" field, best first."""
+    scores = np.fromiter(
+        (s.get("score", 0) for s in sections), dtype=np.float32, count=len(sections)
+    )
+    return [sections[i] for i in top_k_indices(scores, k)]
 
-    except Exception as e:
-        logger.error(f"Error in FAISS search: {e}")
-        return []
+
+# Sections sharing more than this fraction of their shingles count as duplicates,
+# e.g. the same document uploaded twice to a session
+DUPLICATE_SHINGLE_OVERLAP = 0.5
+SHINGLE_WORDS = 8
+
+
+def _shingles(text: str) -> set:
+    words = text.split()
+    if len(words) <= SHINGLE_WORDS:
+        return {hash(" ".join(words))}
+    return {
+        hash(" ".join(words[i : i + SHINGLE_WORDS]))
+        for i in range(len(words) - SHINGLE_WORDS + 1)
+    }
+
+
+def drop_near_duplicates(sections: List[Dict]) -> List[Dict]:
+    """Drop sections whose content mostly repeats a better-ranked section."""
+    kept = []
+    kept_shingles = []
+    for section in sections:
+        shingles = _shingles(section.get("content", ""))
+        if any(
+            len(shingles & other) > DUPLICATE_SHINGLE_OVERLAP * min(len(shingles), len(other))
+            for other in kept_shingles
+        ):
+            continue
+        kept.append(section)
+        kept_shingles.append(shingles)
+    return kept
 
 
-def get_document_info(file_id: str) -> Dict[str, Any]:
-    """Get document information from FAISS metadata."""
+# Each embedding size gets its own global index, so trying a different
+# EMBEDDING_DIMENSIONS never overwrites the index built at another size
+_GLOBAL_SUFFIX = (
+    "" if EMBEDDING_DIMENSION == NATIVE_EMBEDDING_DIMENSIONS else f"_{EMBEDDING_DIMENSION}"
+)
+GLOBAL_INDEX_PATH = FAISS_INDEX_DIR / f"_global{_GLOBAL_SUFFIX}.index"
+GLOBAL_REGISTRY_PATH = FAISS_INDEX_DIR / f"_global{_GLOBAL_SUFFIX}_registry.json"
+
+# Global ids pack the file key into the high bits and the section position
+# into the low bits: (file_key << 32) | position
+FILE_KEY_SHIFT = 32
+POSITION_MASK = (1 << FILE_KEY_SHIFT) - 1
+
+# Sessions with fewer candidate vectors than this are scanned exactly; a very
+# selective id filter can otherwise starve the HNSW walk of results
+EXACT_SEARCH_THRESHOLD = 10000
+
+
+class _ReadWriteLock:
+    """Any number of concurrent readers or one writer; a waiting writer holds off new readers."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+class GlobalIndex:
+    """Single HNSW index over every uploaded file, searched with a per-session id filter."""
+
+    def __init__(
+        self,
+        index_path: Path = GLOBAL_INDEX_PATH,
+        registry_path: Path = GLOBAL_REGISTRY_PATH,
+    ):
+        self.index_path = index_path
+        self.registry_path = registry_path
+        self.index = None
+        # file_id -> {"key": file key, "count": number of vectors}
+        self.files: Dict[str, Dict[str, int]] = {}
+        self.next_key = 0
+        # HNSW searches are safe to run concurrently; only adds need exclusivity
+        self._lock = _ReadWriteLock()
+        # Keeps snapshots reaching disk in the order they were taken
+        self._save_lock = threading.Lock()
+
+        self._load()
+        self._migrate_file_indexes()
+
+    def _load(self):
+        if not (self.index_path.exists() and self.registry_path.exists()):
+            return
+        try:
+            registry = json.loads(self.registry_path.read_text())
+            self.index = faiss.read_index(str(self.index_path))
+            _check_dimension(self.index, "global")
+            self.files = registry["files"]
+            self.next_key = registry["next_key"]
+            # A crash between the two writes in _save leaves the index ahead of
+            # the registry; the per-file indexes are kept, so rebuild from them
+            counted = sum(entry["count"] for entry in self.files.values())
+            if self.index.ntotal != counted:
+                raise ValueError(
+                    f"index holds {self.index.ntotal} vectors, registry lists {counted}"
+                )
+        except Exception as e:
+            logger.error(f"Failed to load global FAISS index, rebuilding it: {e}")
+            self.index, self.files, self.next_key = None, {}, 0
+
+    def _migrate_file_indexes(self):
+        """Fold per-file indexes that predate the global index into it."""
+        migrated = 0
+        for path in FAISS_INDEX_DIR.glob("*.index"):
+            file_id = path.stem
+            if file_id.startswith("_global") or file_id in self.files:
+                continue
+            try:
+                file_index = faiss.read_index(str(path))
+                _check_dimension(file_index, file_id)
+                self._add(file_id, file_index.reconstruct_n(0, file_index.ntotal))
+                migrated += 1
+            except Exception as e:
+                logger.error(f"Could not migrate FAISS index for file {file_id}: {e}")
+
+        if migrated:
+            self._save()
+            logger.info(f"Migrated {migrated} per-file FAISS indexes into the global index")
+
+    def _add(self, file_id: str, vectors: np.ndarray):
+        if self.index is None:
+            # fp16 needs no training, so files added later aren't clipped to
+            # value ranges learned from the first one
+            self.index = faiss.IndexIDMap2(
+                new_hnsw_index(vectors.shape[1], faiss.ScalarQuantizer.QT_fp16)
+            )
+
+        key = self.next_key
+        self.next_key += 1
+        self.index.add_with_ids(vectors, self._ids(key, len(vectors)))
+        self.files[file_id] = {"key": key, "count": len(vectors)}
+
+    def _save(self):
+        """Snapshot the index alongside searches, then write it without holding any index lock."""
+        with self._save_lock:
+            with self._lock.read():
+                data = faiss.serialize_index(self.index)
+                registry = json.dumps({"files": self.files, "next_key": self.next_key})
+
+            tmp_path = self.index_path.with_suffix(".tmp")
+            data.tofile(str(tmp_path))
+            os.replace(tmp_path, self.index_path)
+            tmp_path = self.registry_path.with_suffix(".tmp")
+            tmp_path.write_text(registry)
+            os.replace(tmp_path, self.registry_path)
+
+    @staticmethod
+    def _ids(key: int, count: int) -> np.ndarray:
+        return (np.int64(key) << FILE_KEY_SHIFT) | np.arange(count, dtype=np.int64)
+
+    def has_file(self, file_id: str) -> bool:
+        return file_id in self.files
+
+    def add_file(self, file_id: str, vectors: np.ndarray):
+        """Add a file's normalized section vectors and persist the index."""
+        with self._lock.write():
+            if file_id in self.files:
+                return
+            self._add(file_id, vectors)
+        self._save()
+
+    def search(
+        self, query_vector: np.ndarray, file_ids: List[str], k: int
+    ) -> List[Tuple[str, int, float]]:
+        """Return (file_id, position, score) for the best k sections across file_ids."""
+        with self._lock.read():
+            entries = {self.files[f]["key"]: f for f in file_ids if f in self.files}
+            if self.index is None or not entries:
+                return []
+
+            ids = np.concatenate(
+                [self._ids(key, self.files[f]["count"]) for key, f in entries.items()]
+            )
+            k = min(k, len(ids))
+
+            if len(ids) <= EXACT_SEARCH_THRESHOLD:
+                scores = self.index.reconstruct_batch(ids) @ query_vector[0]
+                top = top_k_indices(scores, k)
+                hits = zip(ids[top], scores[top])
+            else:
+                params = faiss.SearchParametersHNSW(
+                    sel=faiss.IDSelectorBatch(ids),
+                    efSearch=max(HNSW_EF_SEARCH, k),
+                )
+                scores, found = self.index.search(query_vector, k, params=params)
+                hits = ((i, d) for i, d in zip(found[0], scores[0]) if i >= 0)
+
+            return [
+                (entries[int(i) >> FILE_KEY_SHIFT], int(i) & POSITION_MASK, float(d))
+                for i, d in hits
+            ]
+
+
+_global_index: Optional[GlobalIndex] = None
+_global_index_lock = threading.Lock()
+
+
+def get_global_index() -> GlobalIndex:
+    """Return the global index, loading it if startup has not already done so."""
+    global _global_index
+    with _global_index_lock:
+        if _global_index is None:
+            _global_index = GlobalIndex()
+        return _global_index
+
+
+async def load_global_index():
+    """Load the global index, migrating legacy per-file indexes, before serving.
+
+    Migration can take a while; done lazily it would run inside the first chat
+    search and hold up every concurrent one behind the load lock.
+    """
+    await asyncio.to_thread(get_global_index)
+
+
+@lru_cache(maxsize=256)
+def _load_metadata(file_id: str) -> Tuple[Dict, List[Dict]]:
+    return _read_metadata(get_file_paths(file_id)["metadata"])
+
+
+# Repeated questions reuse their embedding instead of another OpenAI round trip;
+# near-duplicate answers are handled separately by utils.semantic_cache
+QUERY_EMBEDDING_CACHE_SIZE = 2000
+QUERY_EMBEDDING_CACHE_TTL = 300
+_query_embedding_cache = TTLCache(
+    maxsize=QUERY_EMBEDDING_CACHE_SIZE, ttl=QUERY_EMBEDDING_CACHE_TTL
+)
+_query_embedding_lock = threading.RLock()
+
+
+def _normalize_query(query: str) -> str:
+    return " ".join(query.split())
+
+
+async def embed_query_vector(query: str) -> np.ndarray:
+    """Embed a query as a normalized (1, d) float32 array."""
+    key = _normalize_query(query)
+    with _query_embedding_lock:
+        cached = _query_embedding_cache.get(key)
+        if cached is not None:
+            return cached
+
+    query_vector = np.array([await embeddings_model.aembed_query(key)], dtype="float32")
+    faiss.normalize_L2(query_vector)
+    query_vector.setflags(write=False)
+
+    with _query_embedding_lock:
+        _query_embedding_cache[key] = query_vector
+    return query_vector
+
+
+# Exact repeats of a question over the same files skip embedding and FAISS entirely
+SEARCH_CACHE_SIZE = 4096
+SEARCH_CACHE_TTL = 600
+_search_results_cache = TTLCache(maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL)
+_search_results_lock = threading.Lock()
+
+
+async def search_files(
+    query: str,
+    file_ids: List[str],
+    limit: int = 5,
+    query_vector: Optional[np.ndarray] = None,
+) -> List[Dict]:
+    """Search several files at once and return the best `limit` sections, best first."""
+    # Uploaded files never change, so a result stays valid for its file set
+    cache_key = (_normalize_query(query), tuple(sorted(file_ids)), limit)
+    with _search_results_lock:
+        cached = _search_results_cache.get(cache_key)
+    if cached is not None:
+        return list(cached)
+
+    loop = asyncio.get_running_loop()
+    sections = []
+    missing = file_ids
+    complete = True
+
     try:
-        _, metadata = load_faiss_index(file_id)
+        global_index = await loop.run_in_executor(None, get_global_index)
+        if query_vector is None:
+            query_vector = await embed_query_vector(query)
+        hits = await loop.run_in_executor(
+            _faiss_pool, global_index.search, query_vector, file_ids, limit
+        )
+        for file_id, position, score in hits:
+            file_fields, file_sections = _load_metadata(file_id)
+            sections.append(_section_hit(file_fields, file_sections[position], score))
+        missing = [f for f in file_ids if not global_index.has_file(f)]
+    except Exception as e:
+        logger.error(f"Global FAISS search failed, searching files individually: {e}")
+        sections = []
+
+    if missing:
+        # Files absent from the global index fall back to their own index,
+        # sharing one query embedding rather than embedding once per file
+        try:
+            if query_vector is None:
+                query_vector = await embed_query_vector(query)
+        except Exception as e:
+            logger.error(f"Failed to embed query for per-file FAISS search: {e}")
+            return top_k_by_score(sections, limit)
+
+        results = await asyncio.gather(
+            *(
+                loop.run_in_executor(
+                    None,
+                    partial(
+                        _search_file,
+                        query=query,
+                        file_id=file_id,
+                        limit=limit,
+                        query_vector=query_vector,
+                    ),
+                )
+                for file_id in missing
+            ),
+            return_exceptions=True,
+        )
+        for file_id, result in zip(missing, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error searching file {file_id}: {result}")
+                complete = False
+                continue
+            sections.extend(result)
+        sections = top_k_by_score(sections, limit)
 
-        max_page = max(item["page_end"] for item in metadata)
-        total_sections = len(metadata)
+    if complete:
+        with _search_results_lock:
+            _search_results_cache[cache_key] = tuple(sections)
+    return sections
+
+
+@lru_cache(maxsize=1024)
+def _load_document_info(file_id: str) -> Dict[str, Any]:
+    """Read document stats from the metadata file; section counts never change after processing."""
+    metadata_path = get_file_paths(file_id)["metadata"]
+    if not metadata_path.exists():
+        raise FileNotFoundError(f"FAISS metadata not found for file {file_id}")
 
+    file_fields, metadata = _read_metadata(metadata_path)
+    if file_fields:
         return {
-            "total_pages": max_page,
-            "total_sections": total_sections,
-            "filename": metadata[0]["filename"] if metadata else "Unknown",
+            "total_pages": file_fields["total_pages"],
+            "total_sections": file_fields["total_sections"],
+            "filename": file_fields["filename"],
         }
+
+    return {
+        "total_pages": max((item["page_end"] for item in metadata), default=0),
+        "total_sections": len(metadata),
+        "filename": metadata[0]["filename"] if metadata else "Unknown",
+    }
+
+
+def get_document_info(file_id: str) -> Optional[Dict[str, Any]]:
+    """Get document information from FAISS metadata, or None if unavailable."""
+    try:
+        return _load_document_info(file_id)
     except Exception as e:
         logger.error(f"Error getting document info: {e}")
-        return {"total_pages": 0, "total_sections": 0, "filename": "Unknown"}
+        return None
 
 
 def process_query_search(query: str, file_id: str) -> Dict[str, Any]:
@@ -264,55 +810,150 @@ def semantic_search(query: str, file_id: str) -> Dict[str, Any]:
     }
 
 
-def count_tokens(text: str) -> int:
+def count_tokens(text: str, encoder=None) -> int:
     """Count tokens in text using tiktoken."""
-    if not tokenizer:
+    encoder = encoder or tokenizer
+    if not encoder:
         return len(text) // 4
-    return len(tokenizer.encode(text))
+    return len(encoder.encode(text))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, encoder=None) -> str:
+    """Cut text down to at most max_tokens tokens."""
+    # Every token covers at least one UTF-8 byte, so texts with no more bytes
+    # than the limit can skip encoding
+    if len(text.encode("utf-8")) <= max_tokens:
+        return text
+    encoder = encoder or tokenizer
+    if not encoder:
+        return text[: max_tokens * 4]
+
+    tokens = encoder.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return encoder.decode(tokens[:max_tokens])
+
+# Large PDFs are split into page ranges of at least this size and
+# extracted in parallel worker processes
+PAGES_PER_WORKER = 20
+
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+_pdf_pool_lock = threading.Lock()
+
+
+def _pdf_pool_context():
+    """Start method for PDF workers; never a fork of the serving process.
+
+    The server runs FAISS/OpenMP, Mongo and HTTP client threads, and forking it
+    can deadlock a worker on a lock one of them holds. Where forkserver exists,
+    workers fork from a separate server process instead. Every worker imports
+    the main module, so it is preloaded there: under ``python main.py`` the
+    whole app (clients, LLM cache, reranker) is imported once in the forkserver,
+    which never serves requests, rather than once per worker. Windows has no
+    forkserver and falls back to spawn, where each worker does that import.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["__main__"])
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = ProcessPoolExecutor(
+                max_workers=PHYSICAL_CORES, mp_context=_pdf_pool_context()
+            )
+        return _pdf_pool
+
+
+def start_pdf_pool() -> None:
+    """Create the PDF extraction pool; called once at application startup."""
+    _get_pdf_pool()
+
+
+def shutdown_pdf_pool() -> None:
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is not None:
+            _pdf_pool.shutdown(wait=False, cancel_futures=True)
+            _pdf_pool = None
+
+
+def _extract_page_range(pdf_bytes: bytes, start: int, end: int) -> List[str]:
+    reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+    return [reader.pages[i].extract_text() for i in range(start, end)]
 
-def extract_pdf_sections(pdf_path: str, max_tokens: int = 500) -> List[Dict[str, Any]]:
-    """Chunk PDF by logical sections with token limits"""
+
+def _extract_page_texts(pdf_file: Union[str, BinaryIO]) -> List[str]:
+    """Extract the text of every page, spreading large PDFs across processes."""
+    pdf_reader = PyPDF2.PdfReader(pdf_file)
+    page_count = len(pdf_reader.pages)
+    workers = min(PHYSICAL_CORES, page_count // PAGES_PER_WORKER)
+    if workers < 2:
+        return [page.extract_text() for page in pdf_reader.pages]
+
+    if isinstance(pdf_file, str):
+        pdf_bytes = Path(pdf_file).read_bytes()
+    else:
+        pdf_file.seek(0)
+        pdf_bytes = pdf_file.read()
+
+    step = -(-page_count // workers)
+    starts = list(range(0, page_count, step))
+    ends = [min(start + step, page_count) for start in starts]
+
+    texts = []
+    for chunk in _get_pdf_pool().map(
+        _extract_page_range, repeat(pdf_bytes, len(starts)), starts, ends
+    ):
+        texts.extend(chunk)
+    return texts
+
+
+def extract_pdf_sections(
+    pdf_file: Union[str, BinaryIO], max_tokens: int = 500
+) -> List[Dict[str, Any]]:
+    """Chunk a PDF path or binary stream by logical sections with token limits"""
     sections = []
     current_section = []
     current_tokens = 0
     hierarchy = 0
-    
-    with open(pdf_path, "rb") as file:
-        pdf_reader = PyPDF2.PdfReader(file)
-        
-        for page_num, page in enumerate(pdf_reader.pages, 1):
-            text = page.extract_text()
-            if not text.strip():
-                continue
-                
-            lines = text.split('\n')
-            header = None
-
-            if len(lines) > 1 and _is_section_header(lines[0]):
-                header = lines[0]
-                hierarchy = _get_header_level(header)
-                remaining_text = "\n".join(lines[1:])
-            else:
-                remaining_text = text
 
-            tokens = count_tokens(remaining_text)
-            
-            if (header or current_tokens + tokens > max_tokens) and current_section:
-                sections.append(_create_section(current_section))
-                current_section = []
-                current_tokens = 0
-                
-            current_section.append({
-                "page": page_num,
-                "header": header,
-                "text": remaining_text,
-                "tokens": tokens,
-                "hierarchy": hierarchy
-            })
-            current_tokens += tokens
+    for page_num, text in enumerate(_extract_page_texts(pdf_file), 1):
+        if not text.strip():
+            continue
             
-        if current_section:
+        lines = text.split('\n')
+        header = None
+
+        if len(lines) > 1 and _is_section_header(lines[0]):
+            header = lines[0]
+            hierarchy = _get_header_level(header)
+            remaining_text = "\n".join(lines[1:])
+        else:
+            remaining_text = text
+
+        tokens = count_tokens(remaining_text)
+        
+        if (header or current_tokens + tokens > max_tokens) and current_section:
             sections.append(_create_section(current_section))
+            current_section = []
+            current_tokens = 0
+            
+        current_section.append({
+            "page": page_num,
+            "header": header,
+            "text": remaining_text,
+            "tokens": tokens,
+            "hierarchy": hierarchy
+        })
+        current_tokens += tokens
+        
+    if current_section:
+        sections.append(_create_section(current_section))
             
     return sections
 
@@ -328,41 +969,47 @@ def _create_section(pages: List[Dict]) -> Dict[str, Any]:
     }
 
 
+# Header patterns compiled once into a single alternation instead of one
+# re.match per pattern per page
+_SECTION_HEADER_RE = re.compile(
+    "|".join(
+        f"(?:{pattern})"
+        for pattern in [
+            r"^[A-Z][A-Z\s]+$",  # ALL CAPS
+            r"^\d+\.\s+[A-Z]",  # Numbered sections
+            r"^[A-Z][a-z]+(\s+[A-Z][a-z]+)*$",  # Title Case
+            r"^Section\s+\d+",  # Section X
+            r"^Chapter\s+\d+",  # Chapter X
+            r"^Article\s+\d+",  # Article X
+            r"^Part\s+\d+",  # Part X
+        ]
+    )
+)
+_HEADER_INDICATOR_RE = re.compile(r"[:.§]")
+_LEVEL_ONE_RE = re.compile(r"chapter|part", re.IGNORECASE)
+_LEVEL_TWO_RE = re.compile(r"section|article", re.IGNORECASE)
+_SUBSECTION_NUMBER_RE = re.compile(r"^\d+\.\d+")
+_SECTION_NUMBER_RE = re.compile(r"^\d+\.")
+
+
 def _is_section_header(line: str) -> bool:
     """Check if a line might be a section header."""
-    header_patterns = [
-        r"^[A-Z][A-Z\s]+$",  # ALL CAPS
-        r"^\d+\.\s+[A-Z]",  # Numbered sections
-        r"^[A-Z][a-z]+(\s+[A-Z][a-z]+)*$",  # Title Case
-        r"^Section\s+\d+",  # Section X
-        r"^Chapter\s+\d+",  # Chapter X
-        r"^Article\s+\d+",  # Article X
-        r"^Part\s+\d+",  # Part X
-    ]
-
-    for pattern in header_patterns:
-        if re.match(pattern, line.strip()):
-            return True
-
-    if len(line.strip()) < 100 and any(
-        indicator in line for indicator in [":", ".", "§"]
-    ):
+    stripped = line.strip()
+    if _SECTION_HEADER_RE.match(stripped):
         return True
 
-    return False
+    return len(stripped) < 100 and bool(_HEADER_INDICATOR_RE.search(line))
 
 
 def _get_header_level(line: str) -> int:
     """Determine the hierarchy level of a header."""
-    line_lower = line.lower()
-
-    if any(word in line_lower for word in ["chapter", "part"]):
+    if _LEVEL_ONE_RE.search(line):
         return 1
-    elif any(word in line_lower for word in ["section", "article"]):
+    elif _LEVEL_TWO_RE.search(line):
         return 2
-    elif re.match(r"^\d+\.\d+", line):
+    elif _SUBSECTION_NUMBER_RE.match(line):
         return 3
-    elif re.match(r"^\d+\.", line):
+    elif _SECTION_NUMBER_RE.match(line):
         return 2
     else:
         return 1
@@ -401,12 +1048,12 @@ def generate_prefilters(metadata: Dict[str, Any]) -> Dict[str, Any]:
 def filtered_vector_search(query: str, file_id: str, filters: Dict[str, Any]) -> List[Dict]:
     """Vector search with pre-filters applied."""
     try:
-        index, metadata = load_faiss_index(file_id)
+        index, file_fields, metadata = load_faiss_index(file_id)
         
-        filtered_indices = []
-        for i, item in enumerate(metadata):
-            if apply_filters(item, filters):
-                filtered_indices.append(i)
+        # A set keeps the membership check below O(1) per hit
+        filtered_indices = {
+            i for i, item in enumerate(metadata) if apply_filters(item, filters)
+        }
         
         if not filtered_indices:
             return search_similar_sections(query, file_id, limit=3)
@@ -419,11 +1066,9 @@ def filtered_vector_search(query: str, file_id: str, filters: Dict[str, Any]) ->
         scores, indices = index.search(query_vector, len(filtered_indices))
         
         results = []
-        for i, idx in enumerate(indices[0]):
-            if idx in filtered_indices and i < 3:  
-                result = metadata[idx].copy()
-                result["score"] = float(scores[0][i])
-                results.append(result)
+        for idx, score in zip(indices[0][:3].tolist(), scores[0][:3].tolist()):
+            if idx in filtered_indices:
+                results.append(_section_hit(file_fields, metadata[idx], score))
         
         return results
         
@@ -445,30 +1090,29 @@ def apply_filters(item: Dict, filters: Dict[str, Any]) -> bool:
     
     return True
 
+def _format_result_line(result: Dict) -> str:
+    return f"• {result['content'][:200]}... (Page {result['page_start']}-{result['page_end']})\n\n"
+
 def generate_filtered_answer(query: str, results: List[Dict], metadata: Dict) -> str:
     """Generate answer for filtered search results."""
     if not results:
         return "No relevant content found with the specified filters."
     
-    answer = f"Based on your search"
+    parts = ["Based on your search"]
     if "page" in metadata:
-        answer += f" around page {metadata['page']}"
+        parts.append(f" around page {metadata['page']}")
     if "section" in metadata:
-        answer += f" in section {metadata['section']}"
-    answer += ":\n\n"
-    
-    for result in results:
-        answer += f"• {result['content'][:200]}... (Page {result['page_start']}-{result['page_end']})\n\n"
-    
-    return answer
+        parts.append(f" in section {metadata['section']}")
+    parts.append(":\n\n")
+    parts.extend(_format_result_line(result) for result in results)
+
+    return "".join(parts)
 
 def generate_answer_with_context(query: str, results: List[Dict]) -> str:
     """Generate answer with page context for regular search."""
     if not results:
         return "No relevant content found."
     
-    answer = "Found relevant information:\n\n"
-    for result in results:
-        answer += f"• {result['content'][:200]}... (Page {result['page_start']}-{result['page_end']})\n\n"
-    
-    return answer
\ No newline at end of file
+    return "Found relevant information:\n\n" + "".join(
+        _format_result_line(result) for result in results
+    )
\ No newline at end of file
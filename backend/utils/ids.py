@@ -0,0 +1,11 @@
+import secrets
+import uuid
+
+from config.config import COMPACT_IDS
+
+
+def new_id() -> str:
+    """Return a new random id for sessions and files."""
+    if COMPACT_IDS:
+        return secrets.token_hex(16)
+    return str(uuid.uuid4())
@@ -0,0 +1,86 @@
+import asyncio
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+from loguru import logger
+
+from config.config import RERANKER_MODEL_DIR
+from utils.faiss_integration import top_k_indices
+
+try:
+    import onnxruntime as ort
+    from tokenizers import Tokenizer
+    RERANKER_IMPORTS_OK = True
+except ImportError as e:
+    logger.warning(f"Reranker dependencies not available, reranking disabled: {e}")
+    RERANKER_IMPORTS_OK = False
+
+MAX_SEQ_LENGTH = 512
+
+
+class CrossEncoderReranker:
+    """Scores (query, passage) pairs jointly with an ONNX cross-encoder."""
+
+    def __init__(self, model_dir: str):
+        model_dir = Path(model_dir)
+        self.session = ort.InferenceSession(
+            str(model_dir / "model.onnx"), providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(str(model_dir / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=MAX_SEQ_LENGTH)
+        self.tokenizer.enable_padding()
+
+    def score(self, query: str, passages: List[str]) -> np.ndarray:
+        """Score all pairs in a single batched session run."""
+        encodings = self.tokenizer.encode_batch([(query, p) for p in passages])
+        feeds = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array(
+                [e.attention_mask for e in encodings], dtype=np.int64
+            ),
+        }
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array(
+                [e.type_ids for e in encodings], dtype=np.int64
+            )
+
+        logits = self.session.run(None, feeds)[0]
+        return logits.reshape(len(passages), -1)[:, 0]
+
+
+reranker = None
+if RERANKER_IMPORTS_OK and RERANKER_MODEL_DIR:
+    try:
+        reranker = CrossEncoderReranker(RERANKER_MODEL_DIR)
+        logger.info(f"Cross-encoder reranker loaded from {RERANKER_MODEL_DIR}")
+    except Exception as e:
+        logger.error(f"Failed to load reranker, reranking disabled: {e}")
+
+
+def reranking_enabled() -> bool:
+    return reranker is not None
+
+
+def _rerank(query: str, sections: List[Dict], top_k: int) -> List[Dict]:
+    scores = reranker.score(query, [s.get("content", "") for s in sections])
+    ranked = []
+    for i in top_k_indices(scores, top_k):
+        section = sections[i].copy()
+        section["rerank_score"] = float(scores[i])
+        ranked.append(section)
+    return ranked
+
+
+async def rerank(query: str, sections: List[Dict], top_k: int) -> List[Dict]:
+    """Reorder retrieved sections by cross-encoder relevance and keep the best top_k."""
+    if reranker is None or len(sections) <= 1:
+        return sections[:top_k]
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, _rerank, query, sections, top_k)
+    except Exception as e:
+        logger.error(f"Reranking failed, keeping FAISS order: {e}")
+        return sections[:top_k]
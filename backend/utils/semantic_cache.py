@@ -0,0 +1,83 @@
+import re
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+import faiss
+import numpy as np
+
+from config.config import SEMANTIC_CACHE_THRESHOLD
+
+MAX_SESSIONS = 1024
+MAX_ENTRIES_PER_SESSION = 64
+
+# Short follow-ups ("explain more", "why?") depend on the conversation so far
+# and must not be answered from the cache
+MIN_QUERY_WORDS = 4
+
+# Longer follow-ups that point back at the conversation ("can you explain that
+# more simply") embed close to unrelated earlier turns, so they are excluded too
+_CONTEXT_DEPENDENT_RE = re.compile(
+    r"\b(?:it|its|that|this|those|these|they|them|above|previous|previously|"
+    r"earlier|again|more|further|simpler|simply|elaborate|continue|you said|"
+    r"last answer)\b",
+    re.IGNORECASE,
+)
+
+
+class _SessionCache:
+    def __init__(self, dimension: int):
+        self.index = faiss.IndexFlatIP(dimension)
+        self.responses: List[List[str]] = []
+
+
+class SemanticCache:
+    """Per-session answer cache keyed by normalized query embeddings."""
+
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD):
+        self.threshold = threshold
+        self._sessions: "OrderedDict[str, _SessionCache]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def is_cacheable(query: str) -> bool:
+        return len(query.split()) >= MIN_QUERY_WORDS and not _CONTEXT_DEPENDENT_RE.search(
+            query
+        )
+
+    def lookup(self, session_id: str, query_vector: np.ndarray) -> Optional[List[str]]:
+        """Return the cached answer chunks for a near-identical earlier query, if any."""
+        with self._lock:
+            cache = self._sessions.get(session_id)
+            if cache is None or cache.index.ntotal == 0:
+                return None
+            self._sessions.move_to_end(session_id)
+
+            scores, ids = cache.index.search(query_vector, 1)
+            if ids[0][0] < 0 or scores[0][0] < self.threshold:
+                return None
+            return cache.responses[ids[0][0]]
+
+    def store(self, session_id: str, query_vector: np.ndarray, chunks: List[str]):
+        with self._lock:
+            cache = self._sessions.get(session_id)
+            if cache is None:
+                cache = self._sessions[session_id] = _SessionCache(query_vector.shape[1])
+            self._sessions.move_to_end(session_id)
+
+            if cache.index.ntotal >= MAX_ENTRIES_PER_SESSION:
+                cache.index.remove_ids(faiss.IDSelectorRange(0, 1))
+                cache.responses.pop(0)
+            cache.index.add(query_vector)
+            cache.responses.append(chunks)
+
+            while len(self._sessions) > MAX_SESSIONS:
+                self._sessions.popitem(last=False)
+
+    def invalidate(self, session_id: str):
+        """Drop cached answers, e.g. after a new document changes what they'd say."""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+semantic_cache = SemanticCache()
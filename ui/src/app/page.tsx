@@ -79,7 +79,17 @@ export default function LawroomAI() {
     wsRef.current.onmessage = (event) => {
       try {
         const data = JSON.parse(event.data);
-        if (data.session_id) {
+        if (data.type === "title_update") {
+          // Titles arrive after the answer; update the sidebar without
+          // switching away from the session the user is viewing now
+          setSessions((prev) =>
+            prev.map((session) =>
+              session.session_id === data.session_id
+                ? { ...session, title: cleanTitle(data.title) }
+                : session
+            )
+          );
+        } else if (data.session_id) {
           setCurrentSessionId(data.session_id);
           currentSessionIdRef.current = data.session_id;
 